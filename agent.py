@@ -1,33 +1,23 @@
+import asyncio
 import os
-import nest_asyncio
-from typing import Optional, Tuple
-from agents import Agent, Runner
-from openai import OpenAI
-from pdf_processor import query_chroma
-from mcp_server import MCPTavilyServer
+import re
+import threading
+from concurrent.futures import Future
+from enum import IntFlag
+from functools import cache, cached_property, lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+import ahocorasick
+import httpx
+from cachetools import TTLCache
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
 from memory_manager import MemoryManager
-from guardrails import GuardrailsManager
+from guardrails import TAIWAN_POLITICS_KEYWORDS, GuardrailsManager
+from response_cache import ResponseCache, SemanticCache
 from dotenv import load_dotenv
 
-# Enable nested event loops
-nest_asyncio.apply()
-
 load_dotenv()
 
-class OpenAIAgentSDK:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        self.mcp_server = MCPTavilyServer()
-        
-        # Initialize memory and guardrails managers
-        self.memory_manager = MemoryManager(self.client)
-        self.guardrails_manager = GuardrailsManager(self.client)
-        
-        # Initialize OpenAI Agent SDK (tools handled separately due to SDK limitations)
-        self.agent = Agent(
-            name="RAG-Web-Search-Agent",
-            model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
-            instructions="""You are an intelligent research assistant with autonomous reasoning capabilities.
+AGENT_INSTRUCTIONS = """You are an intelligent research assistant with autonomous reasoning capabilities.
 
 For each query:
 1. Analyze if you need current information (use web search)
@@ -37,151 +27,557 @@ For each query:
 5. Provide comprehensive, well-researched responses
 
 Always be thorough but concise. Use multiple tools when beneficial."""
+
+class SingleFlight:
+    """Lets concurrent callers asking for the same key share one in-flight call"""
+    
+    def __init__(self):
+        self._inflight: Dict[Tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+    
+    def do(self, key: Tuple[str, str], fn: Callable[[], Any]) -> Any:
+        """Call fn, or wait for the identical call already running and return its result"""
+        with self._lock:
+            future = self._inflight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self._inflight[key] = Future()
+        if not is_leader:
+            return future.result()
+        
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+_single_flight = SingleFlight()
+
+# Chroma results for recently asked queries, keyed by normalized query text
+_rag_cache: TTLCache = TTLCache(
+    maxsize=int(os.getenv("RAG_CACHE_SIZE", "4096")),
+    ttl=int(os.getenv("RAG_CACHE_TTL", "1800"))
+)
+_rag_cache_lock = threading.Lock()
+
+# Tavily results, kept briefly so bursts of the same trending question share one search
+_web_cache: TTLCache = TTLCache(
+    maxsize=int(os.getenv("WEB_CACHE_SIZE", "1024")),
+    ttl=int(os.getenv("WEB_CACHE_TTL", "60"))
+)
+_web_cache_lock = threading.Lock()
+
+def cached_query_chroma(query: str) -> List[str]:
+    """query_chroma with a TTL cache so repeated questions skip the vector search"""
+    key = query.strip().lower()
+    with _rag_cache_lock:
+        results = _rag_cache.get(key)
+    if results is None:
+        from pdf_processor import query_chroma  # Deferred: chromadb is slow to import
+        results = _single_flight.do(("doc", key), lambda: query_chroma(query))
+        if results:  # Don't cache empty results, which may come from a ChromaDB error
+            with _rag_cache_lock:
+                _rag_cache[key] = results
+    return results
+
+def cached_search_web(server, query: str) -> List[Dict]:
+    """server.search_web with a short TTL cache, sharing concurrent identical searches"""
+    key = query.strip().lower()
+    with _web_cache_lock:
+        results = _web_cache.get(key)
+    if results is None:
+        results = _single_flight.do(("web", key), lambda: server.search_web(query))
+        if results:  # Don't cache empty results, which may come from a Tavily error
+            with _web_cache_lock:
+                _web_cache[key] = results
+    return results
+
+@cache
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """Long-lived event loop on a daemon thread, shared by synchronous entrypoints"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="agent-event-loop", daemon=True).start()
+    return loop
+
+# Connection pooling for the OpenAI clients. Idle connections are kept well past httpx's
+# 5 s default so turns a minute apart still reuse a warm TLS connection.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "50"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+_HTTP_LIMITS = httpx.Limits(
+    max_connections=HTTP_POOL_SIZE * 2,
+    max_keepalive_connections=HTTP_POOL_SIZE,
+    keepalive_expiry=HTTP_KEEPALIVE_SECONDS
+)
+
+# Routing keywords (matched as case-insensitive substrings)
+WEB_KEYWORDS: Tuple[str, ...] = (
+    'weather', 'news', 'current', 'today', 'latest', 'stock price', 'happening now', 'temperature', 'forecast'
+)
+DOC_KEYWORDS: Tuple[str, ...] = (
+    'amazon', 'aws', 'shareholder', 'financial', 'revenue', 'business', 'profit', 'earnings', 'annual report'
+)
+# Simple lookups whose top web result can be shown as-is, without an LLM formatting pass
+LOOKUP_KEYWORDS: Tuple[str, ...] = (
+    'weather', 'temperature', 'forecast', 'stock price'
+)
+# Minimum Tavily relevance score for showing the top result directly
+LOOKUP_MIN_SCORE = float(os.getenv("LOOKUP_MIN_SCORE", "0.8"))
+
+class QueryClass(IntFlag):
+    """Keyword classes a query can match, as combinable bit flags"""
+    NONE = 0
+    POLITICS = 1
+    WEB = 2
+    DOC = 4
+    LOOKUP = 8
+
+def _build_classifier() -> ahocorasick.Automaton:
+    """Merge the routing and guardrail keywords into one Aho-Corasick automaton
+    
+    Each keyword maps to the classes it belongs to, and overlapping matches are all reported.
+    """
+    keyword_classes: Dict[str, QueryClass] = {}
+    for keywords, query_class in (
+        (TAIWAN_POLITICS_KEYWORDS, QueryClass.POLITICS),
+        (WEB_KEYWORDS, QueryClass.WEB),
+        (DOC_KEYWORDS, QueryClass.DOC),
+        (LOOKUP_KEYWORDS, QueryClass.LOOKUP)
+    ):
+        for keyword in keywords:
+            keyword_classes[keyword] = keyword_classes.get(keyword, QueryClass.NONE) | query_class
+    automaton = ahocorasick.Automaton()
+    for keyword, query_class in keyword_classes.items():
+        automaton.add_word(keyword, query_class)
+    automaton.make_automaton()
+    return automaton
+
+# Built once at import and shared by every agent instance
+_CLASSIFIER_AC = _build_classifier()
+
+@lru_cache(maxsize=int(os.getenv("ROUTING_CACHE_SIZE", "2048")))
+def classify_query(query: str) -> QueryClass:
+    """Keyword classes of a query, cached so repeated queries skip the scan"""
+    flags = QueryClass.NONE
+    for _, query_class in _CLASSIFIER_AC.iter(query.lower()):
+        flags |= query_class
+    return flags
+
+class OpenAIAgentSDK:
+    # Byte-identical across calls so OpenAI's prompt prefix cache can match it
+    SYSTEM_PROMPT_STATIC = (
+        "You are a helpful research assistant. When the user's message includes search results "
+        "or previous conversation context, provide a natural, helpful response based on that information."
+    )
+    _SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT_STATIC}
+    _AGENT_SYSTEM_MESSAGE = {"role": "system", "content": AGENT_INSTRUCTIONS}
+    
+    def __init__(self):
+        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=DefaultHttpxClient(limits=_HTTP_LIMITS))
+        # Async client for streaming, so network reads never block the event loop
+        self.aclient = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=DefaultAsyncHttpxClient(limits=_HTTP_LIMITS))
+        # Resolved once so every call in this process targets the same model and prefix cache
+        self.model = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+        
+        # Initialize memory and guardrails managers
+        self.memory_manager = MemoryManager(self.client)
+        self.guardrails_manager = GuardrailsManager(self.client)
+        
+        # Exact-match cache for deterministic (temperature=0) completions
+        self.response_cache = ResponseCache()
+        
+        # Similarity cache for paraphrased document questions
+        self.semantic_cache = SemanticCache(self.client)
+    
+    @cached_property
+    def agent(self):
+        """OpenAI Agent SDK agent, built on first use (tools handled separately due to SDK limitations)"""
+        from agents import Agent, ModelSettings  # Deferred: the SDK is slow to import
+        return Agent(
+            name="RAG-Web-Search-Agent",
+            model=self.model,
+            model_settings=ModelSettings(temperature=0),
+            instructions=AGENT_INSTRUCTIONS
         )
     
-    def search_documents_tool(self, query: str) -> str:
-        """Search ChromaDB for document information"""
+    @cached_property
+    def mcp_server(self):
+        """Shared Tavily search server, created on the first web search"""
+        from mcp_server import get_mcp_server  # Deferred: tavily is slow to import
+        return get_mcp_server()
+    
+    def _search_documents(self, query: str) -> Tuple[List[str], str]:
+        """Search ChromaDB, returning the matched documents along with their formatted text"""
         try:
-            results = query_chroma(query)
+            results = cached_query_chroma(query)
             if results and len(results) > 0:
-                return f"Document search results: {results}"
-            return "No relevant documents found."
+                return results, f"Document search results: {results}"
+            return [], "No relevant documents found."
         except Exception as e:
-            return f"Document search error: {str(e)}"
+            return [], f"Document search error: {str(e)}"
     
-    def search_web_tool(self, query: str) -> str:
-        """Search the web for current information"""
+    def search_documents_tool(self, query: str) -> str:
+        """Search ChromaDB for document information"""
+        return self._search_documents(query)[1]
+    
+    def _search_web(self, query: str) -> Tuple[List[Dict], str]:
+        """Search the web, returning the raw results along with their formatted text"""
         try:
-            results = self.mcp_server.search_web(query, max_results=int(os.getenv("MAX_SEARCH_RESULTS", "3")))
+            results = cached_search_web(self.mcp_server, query)
             if results:
                 formatted_results = []
                 for result in results:
                     formatted_results.append(f"Title: {result.get('title', 'N/A')}\nContent: {result.get('content', 'N/A')}\nURL: {result.get('url', 'N/A')}")
-                return f"Web search results:\n\n" + "\n\n".join(formatted_results)
-            return "No web search results found."
+                return results, f"Web search results:\n\n" + "\n\n".join(formatted_results)
+            return [], "No web search results found."
         except Exception as e:
-            return f"Web search error: {str(e)}"
+            return [], f"Web search error: {str(e)}"
+    
+    def search_web_tool(self, query: str) -> str:
+        """Search the web for current information"""
+        return self._search_web(query)[1]
     
-    def check_guardrails(self, user_query: str) -> Tuple[bool, Optional[str]]:
+    def _classify(self, query: str) -> QueryClass:
+        """Match guardrail and routing keywords in a single pass over the query"""
+        return classify_query(query)
+    
+    def check_guardrails(self, user_query: str, query_class: Optional[QueryClass] = None) -> Tuple[bool, Optional[str]]:
         """Check content safety guardrails"""
-        return self.guardrails_manager.check_guardrails(user_query)
+        if query_class is None:
+            query_class = self._classify(user_query)
+        return self.guardrails_manager.check_guardrails(user_query, bool(query_class & QueryClass.POLITICS))
+    
+    def check_guardrails_batch(self, user_queries: List[str]) -> List[Tuple[bool, Optional[str]]]:
+        """Check content safety guardrails for several queries with one moderation call"""
+        return self.guardrails_manager.check_guardrails_batch(
+            user_queries, [bool(self._classify(user_query) & QueryClass.POLITICS) for user_query in user_queries]
+        )
+    
+    def route_categories(self, query: str) -> Set[str]:
+        """Return the tool routes ("web", "doc") a query matches, from one classifier pass"""
+        query_class = self._classify(query)
+        return {route for route, flag in (("web", QueryClass.WEB), ("doc", QueryClass.DOC)) if query_class & flag}
+    
+    def route_batch(self, queries: List[str]) -> List[Tuple[bool, bool]]:
+        """Return (needs web search, needs document search) for each query"""
+        classes = [self._classify(query) for query in queries]
+        return [(bool(query_class & QueryClass.WEB), bool(query_class & QueryClass.DOC)) for query_class in classes]
     
     def needs_web_search(self, query: str) -> bool:
         """Check if query needs web search"""
-        web_keywords = ['weather', 'news', 'current', 'today', 'latest', 'stock price', 'happening now', 'temperature', 'forecast']
-        return any(keyword in query.lower() for keyword in web_keywords)
+        return bool(self._classify(query) & QueryClass.WEB)
     
     def needs_document_search(self, query: str) -> bool:
         """Check if query needs document search"""
-        doc_keywords = ['amazon', 'aws', 'shareholder', 'financial', 'revenue', 'business', 'profit', 'earnings', 'annual report']
-        return any(keyword in query.lower() for keyword in doc_keywords)
+        return bool(self._classify(query) & QueryClass.DOC)
+    
+    def _start_tool_prefetch(self, user_query: str, query_class: QueryClass) -> Dict[str, asyncio.Task]:
+        """Start the routed document search in worker threads so it overlaps the guardrail check
+        
+        Web search is a paid call that can't be interrupted once its thread starts, so it is
+        started separately by _start_web_search after the query passes guardrails.
+        """
+        tasks = {}
+        if query_class & QueryClass.DOC:
+            if not query_class & QueryClass.WEB:
+                # Answers that also draw on live web results aren't reusable for similar questions
+                tasks["embedding"] = asyncio.create_task(asyncio.to_thread(self.semantic_cache.embed, user_query))
+            tasks["doc"] = asyncio.create_task(asyncio.to_thread(self._search_documents, user_query))
+        return tasks
+    
+    def _start_web_search(self, user_query: str, query_class: QueryClass, tool_tasks: Dict[str, asyncio.Task]):
+        """Add the routed web search to the tool tasks"""
+        if query_class & QueryClass.WEB:
+            tool_tasks["web"] = asyncio.create_task(asyncio.to_thread(self._search_web, user_query))
+    
+    async def _format_tool_prompt(self, user_query: str, tool_tasks: Dict[str, asyncio.Task]) -> str:
+        """Wait for the routed searches together and combine their results into one prompt"""
+        sources = [(name, label) for name, label in (("web", "Web search results"), ("doc", "Document search results")) if name in tool_tasks]
+        results = await asyncio.gather(*(tool_tasks[name] for name, _ in sources))
+        # Each task returns (raw results, formatted text); only the text goes in the prompt
+        texts = [text for _, text in results]
+        return f"User asked: {user_query}\n\n" + "\n\n".join(f"{label}: {text}" for (_, label), text in zip(sources, texts))
+    
+    @staticmethod
+    def _cacheable_vector(query_vector, tool_tasks: Dict[str, asyncio.Task]):
+        """The query vector to store the answer under, or None unless the finished doc search found documents
+        
+        Answers built from an empty or failed search must not be reused for similar questions.
+        """
+        if query_vector is None or not tool_tasks["doc"].result()[0]:
+            return None
+        return query_vector
+    
+    async def _check_guardrails_with_prefetch(self, user_query: str, query_class: QueryClass) -> Tuple[bool, Optional[str], Dict[str, asyncio.Task]]:
+        """Run guardrails concurrently with the document prefetch, starting web search only if the query passes"""
+        if query_class & QueryClass.POLITICS:
+            # Already known to be blocked locally; don't speculatively spend tool calls
+            return (*self.check_guardrails(user_query, query_class), {})
+        
+        guardrail_task = asyncio.create_task(
+            self.guardrails_manager.check_guardrails_async(user_query, bool(query_class & QueryClass.POLITICS))
+        )
+        tool_tasks = self._start_tool_prefetch(user_query, query_class)
+        
+        is_blocked, guardrail_message = await guardrail_task
+        if is_blocked:
+            # Stops waiting on the prefetch; searches already running in worker threads still finish
+            for task in tool_tasks.values():
+                task.cancel()
+        else:
+            self._start_web_search(user_query, query_class, tool_tasks)
+        return is_blocked, guardrail_message, tool_tasks
+    
+    async def _lookup_answer(self, query_class: QueryClass, tool_tasks: Dict[str, asyncio.Task]) -> Optional[str]:
+        """Present the top web result of a simple lookup directly, or None to fall back to LLM formatting"""
+        if tool_tasks.keys() != {"web"} or not query_class & QueryClass.LOOKUP:
+            return None
+        results, _ = await tool_tasks["web"]
+        if not results or results[0].get('score', 0) < LOOKUP_MIN_SCORE:
+            return None
+        top = results[0]
+        return f"Here's what I found from {top.get('title', 'the web')}:\n\n{top.get('content', '')}\n\nSource: {top.get('url', 'N/A')}"
     
     async def stream_response_async(self, user_query: str, session_id: str):
-        """Stream response using OpenAI Agents SDK with intelligent tool routing"""
+        """Stream response using OpenAI Agents SDK with intelligent tool routing
+        
+        The work runs on the shared background loop, since the async HTTP connection pool
+        is bound to the loop that opened its connections.
+        """
+        loop = _background_loop()
+        stream = self._stream_response(user_query, session_id)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(stream.__anext__(), loop))
+                except StopAsyncIteration:
+                    break
+        finally:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(stream.aclose(), loop))
+    
+    async def _stream_response(self, user_query: str, session_id: str):
+        """stream_response_async's generator, run on the background loop"""
         
-        # Check guardrails first
-        is_blocked, guardrail_message = self.check_guardrails(user_query)
+        # Normalize whitespace so trivially different queries share cache entries
+        user_query = " ".join(user_query.split())
+        
+        # Fetch conversation memory while guardrails and the routed tool search run
+        memory_task = asyncio.create_task(asyncio.to_thread(self.memory_manager.get_memory_context, session_id))
+        
+        # Classify once; guardrails, routing and the lookup fast path all share the result
+        query_class = self._classify(user_query)
+        
+        # Check guardrails while the routed document search runs
+        is_blocked, guardrail_message, tool_tasks = await self._check_guardrails_with_prefetch(user_query, query_class)
         if is_blocked:
+            memory_task.cancel()
             yield guardrail_message
             return
         
-        # Get conversation memory
-        memory_context = self.memory_manager.get_memory_context(session_id)
-        
-        # Prepare context with memory
-        full_query = f"Previous conversation context: {memory_context}\n\nCurrent query: {user_query}"
+        memory_context = await memory_task
         
-        full_response = ""
+        # Collected chunks, joined once for the memory update
+        parts: List[str] = []
         
         try:
             # Intelligent tool routing with streaming
-            if self.needs_web_search(user_query):
-                # Use web search tool and stream formatted response
-                web_results = self.search_web_tool(user_query)
-                format_prompt = f"User asked: {user_query}\n\nWeb search results: {web_results}\n\nPlease provide a natural, helpful response based on this information."
+            # Reuse the answer to a semantically similar document question, or show a simple lookup directly
+            query_vector = await tool_tasks["embedding"] if "embedding" in tool_tasks else None
+            answer = self.semantic_cache.lookup(query_vector)
+            if answer is None:
+                answer = await self._lookup_answer(query_class, tool_tasks)
+            if answer is not None:
+                # Detach the unneeded searches (their worker threads run to completion)
+                for task in tool_tasks.values():
+                    task.cancel()
+                parts.append(answer)
+                yield answer
                 
-                # Stream the formatted response
-                async for chunk in self._stream_openai_response(format_prompt):
-                    full_response += chunk
-                    yield chunk
-                    
-            elif self.needs_document_search(user_query):
-                # Use document search tool and stream formatted response
-                doc_results = self.search_documents_tool(user_query)
-                format_prompt = f"User asked: {user_query}\n\nDocument search results: {doc_results}\n\nPlease provide a natural, helpful response based on this information."
+            elif tool_tasks:
+                # Use web and/or document search results and stream formatted response
+                messages = self._build_messages(await self._format_tool_prompt(user_query, tool_tasks))
                 
                 # Stream the formatted response
-                async for chunk in self._stream_openai_response(format_prompt):
-                    full_response += chunk
+                async for chunk in self._stream_openai_response(messages, self._cacheable_vector(query_vector, tool_tasks)):
+                    parts.append(chunk)
                     yield chunk
                     
             else:
-                # Stream general query response
-                async for chunk in self._stream_openai_response(full_query):
-                    full_response += chunk
+                # Stream general query response with memory as its own message
+                messages = self._build_messages(user_query, memory_context)
+                async for chunk in self._stream_openai_response(messages):
+                    parts.append(chunk)
                     yield chunk
             
-            # Update conversation memory with full response
-            self.memory_manager.update_memory(session_id, user_query, full_response)
+            # Update conversation memory with full response (off the event loop, since compaction makes a blocking summarization call)
+            await asyncio.to_thread(self.memory_manager.update_memory, session_id, user_query, "".join(parts))
             
         except Exception as e:
             error_msg = f"I encountered an error processing your request: {str(e)}"
             yield error_msg
-            self.memory_manager.update_memory(session_id, user_query, error_msg)
+            await asyncio.to_thread(self.memory_manager.update_memory, session_id, user_query, error_msg)
     
-    async def _stream_openai_response(self, prompt: str):
-        """Stream response from OpenAI using direct client"""
+    def stream_response(self, user_query: str, session_id: str) -> Iterator[str]:
+        """Stream response chunks to synchronous callers as soon as each one is generated"""
+        loop = _background_loop()
+        stream = self._stream_response(user_query, session_id)
         try:
-            stream = self.client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
-                messages=[{"role": "user", "content": prompt}],
+            while True:
+                try:
+                    yield asyncio.run_coroutine_threadsafe(stream.__anext__(), loop).result()
+                except StopAsyncIteration:
+                    break
+        finally:
+            asyncio.run_coroutine_threadsafe(stream.aclose(), loop).result()
+    
+    def process_query(self, user_query: str, session_id: str) -> str:
+        """Synchronous process_query_async, run on the shared background loop instead of a fresh one"""
+        return asyncio.run_coroutine_threadsafe(self._process_query(user_query, session_id), _background_loop()).result()
+    
+    @staticmethod
+    def _canonicalize(text: str) -> str:
+        """Strip trailing spaces and collapse blank-line runs so equal prompts are byte-identical"""
+        text = re.sub(r"[ \t]+\n", "\n", text)
+        return re.sub(r"\n{3,}", "\n\n", text).strip()
+    
+    def _build_messages(self, user_content: str, memory_context: Optional[str] = None) -> List[Dict]:
+        """Build [static system, optional memory, user] messages with all dynamic text after the static prefix"""
+        messages = [self._SYSTEM_MESSAGE]
+        if memory_context is not None:
+            messages.append({"role": "system", "content": f"Previous conversation context: {self._canonicalize(memory_context)}"})
+        messages.append({"role": "user", "content": self._canonicalize(user_content)})
+        return messages
+    
+    async def _stream_openai_response(self, messages: List[Dict], query_vector=None):
+        """Stream response from OpenAI using direct client
+        
+        When query_vector is given, the completed response is also stored in the semantic cache.
+        """
+        cache_key = self.response_cache.make_key(self.model, messages, temperature=0)
+        
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        try:
+            stream = await self.aclient.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0,
                 stream=True
             )
             
-            for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
-                    yield chunk.choices[0].delta.content
+            parts = []
+            async for chunk in stream:
+                content = chunk.choices[0].delta.content
+                if content is not None:
+                    parts.append(content)
+                    yield content
+            
+            response = "".join(parts)
+            self.response_cache.set(cache_key, response)
+            self.semantic_cache.add(query_vector, response)
                     
         except Exception as e:
             yield f"Streaming error: {str(e)}"
+    
+    async def _run_agent(self, prompt: str) -> Optional[str]:
+        """Run the agent on a prompt, reusing cached output for identical prompts"""
+        messages = [
+            {"role": "system", "content": self.agent.instructions},
+            {"role": "user", "content": prompt}
+        ]
+        cache_key = self.response_cache.make_key(self.agent.model, messages, temperature=0)
+        
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        from agents import Runner
+        result = await Runner.run(self.agent, prompt)
+        if result.final_output:
+            self.response_cache.set(cache_key, result.final_output)
+        return result.final_output
+    
+    async def _complete(self, prompt: str) -> Optional[str]:
+        """Answer a prompt under the agent instructions with one direct chat completion
+        
+        Uses the same messages and cache key as _run_agent, without the Agents SDK runner around them.
+        """
+        messages = [self._AGENT_SYSTEM_MESSAGE, {"role": "user", "content": prompt}]
+        cache_key = self.response_cache.make_key(self.model, messages, temperature=0)
+        
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        completion = await self.aclient.chat.completions.create(model=self.model, messages=messages, temperature=0)
+        response = completion.choices[0].message.content
+        if response:
+            self.response_cache.set(cache_key, response)
+        return response
                     
     async def process_query_async(self, user_query: str, session_id: str) -> str:
-        """Process query using hybrid approach with intelligent tool routing"""
+        """Process query using hybrid approach with intelligent tool routing, on the shared background loop"""
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(self._process_query(user_query, session_id), _background_loop())
+        )
+    
+    async def _process_query(self, user_query: str, session_id: str) -> str:
+        """process_query_async's body, run on the background loop"""
+        
+        # Normalize whitespace so trivially different queries share cache entries
+        user_query = " ".join(user_query.split())
+        
+        # Fetch conversation memory while guardrails and the routed tool search run
+        memory_task = asyncio.create_task(asyncio.to_thread(self.memory_manager.get_memory_context, session_id))
+        
+        # Classify once; guardrails, routing and the lookup fast path all share the result
+        query_class = self._classify(user_query)
         
-        # Check guardrails first
-        is_blocked, guardrail_message = self.check_guardrails(user_query)
+        # Check guardrails while the routed document search runs
+        is_blocked, guardrail_message, tool_tasks = await self._check_guardrails_with_prefetch(user_query, query_class)
         if is_blocked:
+            memory_task.cancel()
             return guardrail_message
         
-        # Get conversation memory
-        memory_context = self.memory_manager.get_memory_context(session_id)
+        memory_context = await memory_task
         
         # Prepare context with memory
         full_query = f"Previous conversation context: {memory_context}\n\nCurrent query: {user_query}"
         
         try:
             # Intelligent tool routing
-            if self.needs_web_search(user_query):
-                # Use web search tool and format with OpenAI
-                web_results = self.search_web_tool(user_query)
-                format_prompt = f"User asked: {user_query}\n\nWeb search results: {web_results}\n\nPlease provide a natural, helpful response based on this information."
-                result = Runner.run_sync(self.agent, format_prompt)
-                response = result.final_output or "I found some information but couldn't format it properly."
+            # Reuse the answer to a semantically similar document question, or show a simple lookup directly
+            query_vector = await tool_tasks["embedding"] if "embedding" in tool_tasks else None
+            response = self.semantic_cache.lookup(query_vector)
+            if response is None:
+                response = await self._lookup_answer(query_class, tool_tasks)
+            if response is not None:
+                # Detach the unneeded searches (their worker threads run to completion)
+                for task in tool_tasks.values():
+                    task.cancel()
                 
-            elif self.needs_document_search(user_query):
-                # Use document search tool and format with OpenAI
-                doc_results = self.search_documents_tool(user_query)
-                format_prompt = f"User asked: {user_query}\n\nDocument search results: {doc_results}\n\nPlease provide a natural, helpful response based on this information."
-                result = Runner.run_sync(self.agent, format_prompt)
-                response = result.final_output or "I found some information but couldn't format it properly."
+            elif tool_tasks:
+                # Use web and/or document search results and format with OpenAI
+                format_prompt = f"{await self._format_tool_prompt(user_query, tool_tasks)}\n\nPlease provide a natural, helpful response based on this information."
+                response = await self._run_agent(format_prompt)
+                if response:
+                    self.semantic_cache.add(self._cacheable_vector(query_vector, tool_tasks), response)
+                else:
+                    response = "I found some information but couldn't format it properly."
                 
             else:
-                # Use OpenAI Agents SDK for general queries
-                result = Runner.run_sync(self.agent, full_query)
-                response = result.final_output or "I apologize, but I couldn't generate a response."
+                # General queries need no tools, so skip the Agents SDK runner
+                response = await self._complete(full_query) or "I apologize, but I couldn't generate a response."
             
-            # Update conversation memory
-            self.memory_manager.update_memory(session_id, user_query, response)
+            # Update conversation memory (off the event loop, since compaction makes a blocking summarization call)
+            await asyncio.to_thread(self.memory_manager.update_memory, session_id, user_query, response)
             
             return response
             
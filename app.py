@@ -1,3 +1,8 @@
+import asyncio
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 import chainlit as cl
 import os
 from dotenv import load_dotenv
@@ -5,9 +10,25 @@ from agent import OpenAIAgentSDK
 
 load_dotenv()
 
+def configure_logging():
+    """Hand log records to a background thread so handler I/O never blocks the event loop"""
+    root = logging.getLogger()
+    handlers = root.handlers or [logging.StreamHandler()]  # Reuse Chainlit's console handler when present
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    root.handlers = [QueueHandler(log_queue)]
+    listener.start()
+    atexit.register(listener.stop)
+
+configure_logging()
+
 # Initialize agent with OpenAI Agents SDK
 agent = OpenAIAgentSDK()
 
+# Coalesce streamed deltas so each websocket send carries a useful amount of text
+STREAM_FLUSH_CHARS = 64
+STREAM_FLUSH_INTERVAL = 0.03  # seconds
+
 @cl.password_auth_callback
 def auth_callback(username: str, password: str):
     if username == os.getenv("CHAINLIT_USERNAME") and password == os.getenv("CHAINLIT_PASSWORD"):
@@ -29,11 +50,22 @@ async def main(message: cl.Message):
     await msg.send()
     
     try:
-        # Stream response in real-time
-        full_response = ""
+        # Stream response in real-time, flushing buffered deltas by size or age
+        loop = asyncio.get_running_loop()
+        buffer = []
+        buffered_chars = 0
+        last_flush = loop.time()
         async for chunk in agent.stream_response_async(message.content, session_id):
-            full_response += chunk
-            await msg.stream_token(chunk)
+            buffer.append(chunk)
+            buffered_chars += len(chunk)
+            if buffered_chars >= STREAM_FLUSH_CHARS or loop.time() - last_flush >= STREAM_FLUSH_INTERVAL:
+                await msg.stream_token("".join(buffer))
+                buffer.clear()
+                buffered_chars = 0
+                last_flush = loop.time()
+        
+        if buffer:
+            await msg.stream_token("".join(buffer))
         
         # Update final message
         await msg.update()
@@ -0,0 +1,26 @@
+"""
+Shared pytest fixtures for the OpenAI Agent App tests
+"""
+
+import os
+import pytest
+
+
+@pytest.fixture(scope="session")
+def agent(tmp_path_factory):
+    """One agent for the whole test session, since construction opens the API clients"""
+    missing_vars = [var for var in ("OPENAI_API_KEY", "TAVILY_API_KEY") if not os.getenv(var)]
+    if missing_vars:
+        pytest.skip(f"Missing environment variables: {missing_vars}")
+    
+    from agent import OpenAIAgentSDK
+    # Persist test conversations to a throwaway database, never the app's memory.db
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("MEMORY_DB_PATH", str(tmp_path_factory.mktemp("memory") / "memory.db"))
+        return OpenAIAgentSDK()
+
+
+@pytest.fixture
+def anyio_backend():
+    """Run async tests on asyncio"""
+    return "asyncio"
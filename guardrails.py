@@ -3,21 +3,112 @@ Guardrails Module for OpenAI Agent App
 Handles content safety, moderation, and topic filtering
 """
 
-from typing import Tuple, Optional
+import asyncio
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Tuple, Optional
+import ahocorasick
+from cachetools import TTLCache
 from openai import OpenAI
 
+logger = logging.getLogger(__name__)
+
+
+# Taiwan politics keywords for filtering (matched as case-insensitive substrings)
+TAIWAN_POLITICS_KEYWORDS: Tuple[str, ...] = (
+    'taiwan politics', 'taiwanese politics', 'taiwan election', 'taiwan government',
+    'dpp', 'kmt', 'taiwan independence', 'taiwan unification', 'cross-strait',
+    'taiwan china', 'taiwan president', 'taiwan democracy', 'taiwan party',
+    'pan-blue', 'pan-green', 'taiwan political', 'taiwan vote', 'taiwan campaign'
+)
+
+
+def _build_politics_automaton() -> ahocorasick.Automaton:
+    """Compile the Taiwan politics keywords into one Aho-Corasick automaton (matched against the lowercased query)"""
+    automaton = ahocorasick.Automaton()
+    for keyword in TAIWAN_POLITICS_KEYWORDS:
+        automaton.add_word(keyword, keyword)
+    automaton.make_automaton()
+    return automaton
+
+# Built once at import and shared by every GuardrailsManager
+_POLITICS_AC = _build_politics_automaton()
+
+
+class ModerationBatcher:
+    """Coalesces concurrent moderation checks into single array-input API calls"""
+    
+    def __init__(self, openai_client: OpenAI):
+        self.client = openai_client
+        self.max_batch = int(os.getenv("MODERATION_BATCH_SIZE", "16"))
+        self.max_wait = int(os.getenv("MODERATION_BATCH_WAIT_MS", "20")) / 1000
+        # Longest a caller waits for its verdict before failing open
+        self.timeout = float(os.getenv("MODERATION_TIMEOUT", "10"))
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="moderation")
+        self._collector: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+    
+    def submit(self, text: str) -> Future:
+        """Queue text for moderation; the future resolves to its flagged verdict"""
+        future: Future = Future()
+        self._queue.put((text, future))
+        self._ensure_collector()
+        return future
+    
+    def _ensure_collector(self):
+        """Start the background collector thread on first use"""
+        if self._collector is None:
+            with self._lock:
+                if self._collector is None:
+                    self._collector = threading.Thread(target=self._collect, name="moderation-batcher", daemon=True)
+                    self._collector.start()
+    
+    def _collect(self):
+        """Drain up to max_batch queued texts within max_wait and dispatch them together"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._dispatch, batch)
+    
+    def _dispatch(self, batch: List[Tuple[str, Future]]):
+        """Send one moderation request for the whole batch and resolve each future"""
+        try:
+            moderation = self.client.moderations.create(input=[text for text, _ in batch])
+            if len(moderation.results) != len(batch):
+                raise ValueError(f"Moderation returned {len(moderation.results)} results for {len(batch)} inputs")
+            for (_, future), result in zip(batch, moderation.results):
+                future.set_result(result.flagged)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
 
 class GuardrailsManager:
     def __init__(self, openai_client: OpenAI):
         self.client = openai_client
+        self.moderation_batcher = ModerationBatcher(openai_client)
         
-        # Taiwan politics keywords for filtering
-        self.taiwan_politics_keywords = [
-            'taiwan politics', 'taiwanese politics', 'taiwan election', 'taiwan government',
-            'dpp', 'kmt', 'taiwan independence', 'taiwan unification', 'cross-strait',
-            'taiwan china', 'taiwan president', 'taiwan democracy', 'taiwan party',
-            'pan-blue', 'pan-green', 'taiwan political', 'taiwan vote', 'taiwan campaign'
-        ]
+        # Moderation verdicts keyed by query hash; repeated queries skip the API round-trip
+        self._moderation_cache: TTLCache = TTLCache(
+            maxsize=int(os.getenv("MODERATION_CACHE_SIZE", "10000")),
+            ttl=int(os.getenv("MODERATION_CACHE_TTL", "86400"))
+        )
+        self._moderation_cache_lock = threading.Lock()
         
         # Polite response for blocked content
         self.blocked_response = (
@@ -32,17 +123,21 @@ class GuardrailsManager:
             "helpful conversations. Could we explore something else I can assist you with today? 😊"
         )
     
-    def check_guardrails(self, user_query: str) -> Tuple[bool, Optional[str]]:
+    def check_guardrails(self, user_query: str, contains_politics: Optional[bool] = None) -> Tuple[bool, Optional[str]]:
         """
         Enhanced guardrails for inappropriate content and Taiwan politics
         
+        Args:
+            contains_politics: Politics keyword verdict already computed by the caller, if any
+        
         Returns:
             Tuple[bool, Optional[str]]: (is_blocked, response_message)
         """
-        query_lower = user_query.lower()
+        if contains_politics is None:
+            contains_politics = self._contains_taiwan_politics(user_query)
         
         # Check for Taiwan politics
-        if self._contains_taiwan_politics(query_lower):
+        if contains_politics:
             return True, self.blocked_response
         
         # Check OpenAI moderation for abusive content
@@ -51,16 +146,117 @@ class GuardrailsManager:
         
         return False, None
     
-    def _contains_taiwan_politics(self, query_lower: str) -> bool:
+    def check_guardrails_batch(self, user_queries: List[str], contains_politics: Optional[List[bool]] = None) -> List[Tuple[bool, Optional[str]]]:
+        """check_guardrails for several queries, moderating all that need it in one API call"""
+        if contains_politics is None:
+            contains_politics = [self._contains_taiwan_politics(user_query) for user_query in user_queries]
+        
+        # Only queries that pass the politics check need moderation
+        flagged = iter(self._check_openai_moderation_batch(
+            [user_query for user_query, politics in zip(user_queries, contains_politics) if not politics]
+        ))
+        
+        results = []
+        for politics in contains_politics:
+            if politics:
+                results.append((True, self.blocked_response))
+            elif next(flagged):
+                results.append((True, self.moderation_response))
+            else:
+                results.append((False, None))
+        return results
+    
+    async def check_guardrails_async(self, user_query: str, contains_politics: Optional[bool] = None) -> Tuple[bool, Optional[str]]:
+        """check_guardrails for async callers; awaits moderation without occupying a worker thread"""
+        if contains_politics is None:
+            contains_politics = self._contains_taiwan_politics(user_query)
+        
+        # Check for Taiwan politics
+        if contains_politics:
+            return True, self.blocked_response
+        
+        # Check OpenAI moderation for abusive content
+        if await self._check_openai_moderation_async(user_query):
+            return True, self.moderation_response
+        
+        return False, None
+    
+    def _contains_taiwan_politics(self, user_query: str) -> bool:
         """Check if query contains Taiwan politics keywords"""
-        return any(keyword in query_lower for keyword in self.taiwan_politics_keywords)
+        return next(_POLITICS_AC.iter(user_query.lower()), None) is not None
+    
+    def _cached_moderation(self, user_query: str) -> Tuple[str, Optional[bool]]:
+        """Return the moderation cache key for a query and its cached verdict, if any
+        
+        Keys are taken over the case- and whitespace-normalized query so trivially edited repeats share a verdict.
+        """
+        key = hashlib.blake2b(" ".join(user_query.lower().split()).encode(), digest_size=16).hexdigest()
+        with self._moderation_cache_lock:
+            return key, self._moderation_cache.get(key)
+    
+    def _store_moderation(self, key: str, flagged: bool):
+        """Cache a moderation verdict"""
+        with self._moderation_cache_lock:
+            self._moderation_cache[key] = flagged
     
     def _check_openai_moderation(self, user_query: str) -> bool:
         """Check OpenAI moderation API for inappropriate content"""
+        if not user_query.strip():
+            return False  # Nothing to moderate
+        
+        key, flagged = self._cached_moderation(user_query)
+        if flagged is not None:
+            return flagged
+        
         try:
-            moderation = self.client.moderations.create(input=user_query)
-            result = moderation.results[0]
-            return result.flagged
+            flagged = self.moderation_batcher.submit(user_query).result(timeout=self.moderation_batcher.timeout)
+            self._store_moderation(key, flagged)
+            return flagged
         except Exception as e:
-            print(f"Moderation API error: {e}")
+            logger.warning("Moderation API error: %s", e)
             return False  # Allow if moderation fails
+    
+    async def _check_openai_moderation_async(self, user_query: str) -> bool:
+        """Check OpenAI moderation API for inappropriate content without blocking the event loop"""
+        if not user_query.strip():
+            return False  # Nothing to moderate
+        
+        key, flagged = self._cached_moderation(user_query)
+        if flagged is not None:
+            return flagged
+        
+        try:
+            flagged = await asyncio.wait_for(
+                asyncio.wrap_future(self.moderation_batcher.submit(user_query)), self.moderation_batcher.timeout
+            )
+            self._store_moderation(key, flagged)
+            return flagged
+        except Exception as e:
+            logger.warning("Moderation API error: %s", e)
+            return False  # Allow if moderation fails
+    
+    def _check_openai_moderation_batch(self, user_queries: List[str]) -> List[bool]:
+        """Check several queries against the moderation API, sending the uncached ones in one request"""
+        verdicts: List[Optional[bool]] = []
+        pending = []
+        for index, user_query in enumerate(user_queries):
+            if not user_query.strip():
+                verdicts.append(False)  # Nothing to moderate
+                continue
+            key, flagged = self._cached_moderation(user_query)
+            verdicts.append(flagged)
+            if flagged is None:
+                pending.append((index, key))
+        
+        if pending:
+            # Called directly rather than through the batcher, which may split or mix batches
+            try:
+                moderation = self.client.moderations.create(input=[user_queries[index] for index, _ in pending])
+                for (index, key), result in zip(pending, moderation.results):
+                    verdicts[index] = result.flagged
+                    self._store_moderation(key, result.flagged)
+            except Exception as e:
+                logger.warning("Moderation API error: %s", e)
+                for index, _ in pending:
+                    verdicts[index] = False  # Allow if moderation fails
+        return verdicts
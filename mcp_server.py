@@ -1,16 +1,45 @@
+import logging
+from functools import cache
+import requests
+from requests.adapters import HTTPAdapter
 from tavily import TavilyClient
 import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MAX_SEARCH_RESULTS = int(os.getenv("MAX_SEARCH_RESULTS", "3"))
+MAX_RESULT_CHARS = int(os.getenv("MAX_RESULT_CHARS", "800"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "50"))
 
 class MCPTavilyServer:
     def __init__(self):
-        self.client = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+        # Keep-alive session sized for concurrent searches, so each one reuses a warm TLS connection
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE))
+        self.client = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"), session=session)
     
-    def search_web(self, query, max_results=None):
+    def search_web(self, query, max_results=None, max_chars_per_result=None):
         if max_results is None:
-            max_results = int(os.getenv("MAX_SEARCH_RESULTS", "3"))
+            max_results = MAX_SEARCH_RESULTS
+        if max_chars_per_result is None:
+            max_chars_per_result = MAX_RESULT_CHARS
         try:
             response = self.client.search(query=query, max_results=max_results)
-            return response.get("results", [])
+            results = response.get("results", [])
+            # Trim page content here so callers never copy or prompt with full page bodies
+            for result in results:
+                content = result.get("content")
+                if content and len(content) > max_chars_per_result:
+                    result["content"] = content[:max_chars_per_result]
+            return results
         except Exception as e:
-            print(f"Tavily search error: {e}")
+            logger.warning("Tavily search error: %s", e)
             return []
+
+@cache
+def get_mcp_server():
+    """Return the process-wide server so its Tavily HTTP session is reused across queries"""
+    return MCPTavilyServer()
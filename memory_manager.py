@@ -3,61 +3,220 @@ Memory Management Module for OpenAI Agent App
 Handles conversation memory, context retrieval, and automatic compaction
 """
 
+import logging
 import os
+import sqlite3
+import threading
 import time
-from typing import Dict, List, Optional
+from collections import deque
+from itertools import islice
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+from cachetools import TTLCache
 from openai import OpenAI
 
+logger = logging.getLogger(__name__)
+
+NO_CONVERSATION = "No previous conversation."
+
+
+class SessionMemory:
+    """A session's exchanges stored column-wise in parallel bounded deques"""
+    
+    __slots__ = ("users", "assistants", "rendered", "timestamps", "appended", "compacting")
+    
+    def __init__(self, maxlen: int, rows: Iterable[Tuple[str, str, float]] = ()):
+        self.users: Deque[str] = deque(maxlen=maxlen)
+        self.assistants: Deque[str] = deque(maxlen=maxlen)
+        self.rendered: Deque[str] = deque(maxlen=maxlen)
+        self.timestamps: Deque[float] = deque(maxlen=maxlen)
+        self.appended = 0  # Total exchanges ever appended, used to find rows added during compaction
+        self.compacting = False  # Set while a summarization for this session is in flight
+        for user, assistant, timestamp in rows:
+            self.append(user, assistant, timestamp)
+    
+    def __len__(self) -> int:
+        return len(self.users)
+    
+    def append(self, user: str, assistant: str, timestamp: Optional[float] = None):
+        """Append an exchange, pre-rendering its context line once"""
+        self.users.append(user)
+        self.assistants.append(assistant)
+        self.rendered.append(f"User: {user}\nAssistant: {assistant}")
+        self.timestamps.append(time.time() if timestamp is None else timestamp)
+        self.appended += 1
+    
+    def rows(self, start: int = 0) -> List[Tuple[str, str, float]]:
+        """Return (user, assistant, timestamp) rows from position start onwards"""
+        return list(islice(zip(self.users, self.assistants, self.timestamps), start, None))
+
 
 class MemoryManager:
     def __init__(self, openai_client: OpenAI):
         self.client = openai_client
-        self.conversation_memory: Dict[str, List[Dict]] = {}
         self.max_exchanges = int(os.getenv("MAX_EXCHANGES", "20"))  # Maximum exchanges before compaction
         self.keep_recent = int(os.getenv("KEEP_RECENT_EXCHANGES", "5"))     # Recent exchanges to keep after compaction
+        # Sessions are partitioned across independently locked shards so concurrent
+        # requests only contend with sessions in the same shard. Idle sessions expire
+        # so memory stays bounded in long-running servers.
+        self.num_shards = 16
+        max_sessions = int(os.getenv("MAX_SESSIONS", "10000"))
+        session_ttl = int(os.getenv("SESSION_TTL", "3600"))
+        self._memory_shards: List["TTLCache[str, SessionMemory]"] = [
+            TTLCache(maxsize=max(max_sessions // self.num_shards, 1), ttl=session_ttl)
+            for _ in range(self.num_shards)
+        ]
+        self._memory_locks = [threading.RLock() for _ in range(self.num_shards)]
+        # Rendered context strings, invalidated whenever a session's exchanges change
+        self._context_shards: List["TTLCache[str, str]"] = [
+            TTLCache(maxsize=max(max_sessions // self.num_shards, 1), ttl=session_ttl)
+            for _ in range(self.num_shards)
+        ]
+        
+        # Exchanges are also written to SQLite so conversations survive restarts;
+        # sessions missing from the in-memory shards are loaded from it on first access.
+        self.session_ttl = session_ttl
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        db_path = os.getenv("MEMORY_DB_PATH", "./memory.db")
+        if db_path:
+            self._db = self._open_db(db_path)
+    
+    def _open_db(self, db_path: str) -> sqlite3.Connection:
+        """Open the memory database, creating its schema and dropping expired sessions"""
+        db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS exchanges ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+            "ts REAL NOT NULL, user TEXT NOT NULL, assistant TEXT NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS idx_exchanges_session ON exchanges (session_id, id)")
+        db.execute(
+            "DELETE FROM exchanges WHERE session_id IN "
+            "(SELECT session_id FROM exchanges GROUP BY session_id HAVING MAX(ts) < ?)",
+            (time.time() - self.session_ttl,)
+        )
+        return db
+    
+    def _shard(self, session_id: str) -> Tuple["TTLCache[str, SessionMemory]", threading.RLock]:
+        """Return the memory shard and lock that own a session"""
+        index = hash(session_id) % self.num_shards
+        return self._memory_shards[index], self._memory_locks[index]
+    
+    def _context_shard(self, session_id: str) -> "TTLCache[str, str]":
+        """Return the rendered-context cache shard for a session (guarded by its memory shard lock)"""
+        return self._context_shards[hash(session_id) % self.num_shards]
+    
+    def _get_session(self, session_id: str) -> Optional[SessionMemory]:
+        """Return a session's exchanges, loading them from the database if not in memory
+        
+        Must be called with the session's shard lock held.
+        """
+        shard, _ = self._shard(session_id)
+        memory = shard.get(session_id)
+        if memory is None and self._db is not None:
+            with self._db_lock:
+                rows = self._db.execute(
+                    "SELECT user, assistant, ts FROM exchanges WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                    (session_id, self.max_exchanges)
+                ).fetchall()
+                if rows and max(ts for _, _, ts in rows) < time.time() - self.session_ttl:
+                    # Idle past SESSION_TTL: expire it like the in-memory shards do
+                    self._db.execute("DELETE FROM exchanges WHERE session_id = ?", (session_id,))
+                    rows = []
+            if rows:
+                memory = SessionMemory(self.max_exchanges, reversed(rows))
+                shard[session_id] = memory
+        return memory
+    
+    def _persist_exchange(self, session_id: str, memory: SessionMemory):
+        """Append a session's latest exchange to the database"""
+        if self._db is None:
+            return
+        with self._db_lock:
+            self._db.execute(
+                "INSERT INTO exchanges (session_id, ts, user, assistant) VALUES (?, ?, ?, ?)",
+                (session_id, memory.timestamps[-1], memory.users[-1], memory.assistants[-1])
+            )
+    
+    def _persist_session(self, session_id: str, rows: List[Tuple[str, str, float]]):
+        """Replace a session's stored exchanges"""
+        if self._db is None:
+            return
+        with self._db_lock:
+            with self._db:
+                self._db.execute("BEGIN")
+                self._db.execute("DELETE FROM exchanges WHERE session_id = ?", (session_id,))
+                self._db.executemany(
+                    "INSERT INTO exchanges (session_id, ts, user, assistant) VALUES (?, ?, ?, ?)",
+                    [(session_id, ts, user, assistant) for user, assistant, ts in rows]
+                )
     
     def get_memory_context(self, session_id: str) -> str:
         """Get conversation memory for session"""
-        if session_id not in self.conversation_memory:
-            return "No previous conversation."
-        
-        memory = self.conversation_memory[session_id]
-        context_parts = []
-        
-        # Use last 10 exchanges (20 turns) for better context
-        for exchange in memory[-10:]:
-            context_parts.append(f"User: {exchange['user']}")
-            context_parts.append(f"Assistant: {exchange['assistant']}")
-        
-        return "\n".join(context_parts)
+        shard, lock = self._shard(session_id)
+        contexts = self._context_shard(session_id)
+        with lock:
+            context = contexts.get(session_id)
+            if context is not None:
+                return context
+            
+            memory = self._get_session(session_id)
+            if memory is None:
+                # Cached too, so repeated reads of an empty session skip the database lookup
+                contexts[session_id] = NO_CONVERSATION
+                return NO_CONVERSATION
+            
+            # Use last 10 exchanges (20 turns) for better context
+            context = "\n".join(islice(memory.rendered, max(len(memory) - 10, 0), None))
+            contexts[session_id] = context
+            return context
     
     def update_memory(self, session_id: str, user_query: str, response: str):
         """Update conversation memory with automatic summarization"""
-        if session_id not in self.conversation_memory:
-            self.conversation_memory[session_id] = []
-        
-        self.conversation_memory[session_id].append({
-            'user': user_query,
-            'assistant': response,
-            'timestamp': time.time()
-        })
+        shard, lock = self._shard(session_id)
+        with lock:
+            memory = self._get_session(session_id)
+            if memory is None:
+                memory = SessionMemory(self.max_exchanges)
+            
+            memory.append(user_query, response)
+            # Re-inserting refreshes the session's TTL on every turn
+            shard[session_id] = memory
+            self._context_shard(session_id).pop(session_id, None)
+            self._persist_exchange(session_id, memory)
+            # Only one summarization per session at a time; turns added meanwhile are kept after it
+            needs_compaction = len(memory) >= self.max_exchanges and not memory.compacting
+            if needs_compaction:
+                memory.compacting = True
         
         # When reaching max exchanges, summarize and compact
-        if len(self.conversation_memory[session_id]) >= self.max_exchanges:
+        if needs_compaction:
             self._compact_memory(session_id)
     
     def _compact_memory(self, session_id: str):
-        """Compact memory by summarizing older conversations"""
-        memory = self.conversation_memory[session_id]
+        """Compact memory by summarizing older conversations
+        
+        The summarization call runs without holding the shard lock; exchanges added
+        meanwhile are kept after the compacted history.
+        """
+        shard, lock = self._shard(session_id)
+        with lock:
+            snapshot = shard.get(session_id)
+            if snapshot is None:
+                return
+            memory = snapshot.rows()
+            appended = snapshot.appended
         
         # Take older exchanges for summarization, keep recent ones
         old_conversations = memory[:-self.keep_recent]
         recent_conversations = memory[-self.keep_recent:]
         
         # Create summary of old conversations
-        conversation_text = ""
-        for exchange in old_conversations:
-            conversation_text += f"User: {exchange['user']}\nAssistant: {exchange['assistant']}\n\n"
+        conversation_text = "".join(
+            f"User: {user}\nAssistant: {assistant}\n\n" for user, assistant, _ in old_conversations
+        )
         
         try:
             # Use OpenAI to summarize
@@ -72,35 +231,48 @@ class MemoryManager:
             
             summary = summary_response.choices[0].message.content
             
-            # Replace old conversations with summary
-            self.conversation_memory[session_id] = [
-                {
-                    'user': '[Previous conversation summary]', 
-                    'assistant': summary,
-                    'timestamp': time.time()
-                }
-            ] + recent_conversations
+            # Replace old conversations with summary, or just keep recent ones if none came back
+            if summary:
+                compacted = [('[Previous conversation summary]', summary, time.time())] + recent_conversations
+            else:
+                compacted = recent_conversations
             
         except Exception as e:
-            print(f"Memory compaction error: {e}")
+            logger.warning("Memory compaction error: %s", e)
             # Fallback: just keep recent conversations
-            self.conversation_memory[session_id] = recent_conversations
+            compacted = recent_conversations
+        
+        with lock:
+            snapshot.compacting = False
+            current = shard.get(session_id)
+            if current is not snapshot:
+                return  # Session was cleared or expired while summarizing
+            added = current.appended - appended
+            newer = current.rows(max(len(current) - added, 0)) if added else []
+            shard[session_id] = SessionMemory(self.max_exchanges, compacted + newer)
+            self._context_shard(session_id).pop(session_id, None)
+            self._persist_session(session_id, compacted + newer)
     
     def clear_session_memory(self, session_id: str):
         """Clear memory for a specific session"""
-        if session_id in self.conversation_memory:
-            del self.conversation_memory[session_id]
+        shard, lock = self._shard(session_id)
+        with lock:
+            shard.pop(session_id, None)
+            self._context_shard(session_id)[session_id] = NO_CONVERSATION
+            self._persist_session(session_id, [])
     
     def get_session_stats(self, session_id: str) -> Dict:
         """Get statistics for a session's memory"""
-        if session_id not in self.conversation_memory:
-            return {"exchanges": 0, "total_tokens_estimate": 0}
-        
-        memory = self.conversation_memory[session_id]
-        total_chars = sum(len(ex['user']) + len(ex['assistant']) for ex in memory)
-        
-        return {
-            "exchanges": len(memory),
-            "total_chars": total_chars,
-            "estimated_tokens": total_chars // 4  # Rough estimate
-        }
+        shard, lock = self._shard(session_id)
+        with lock:
+            memory = self._get_session(session_id)
+            if memory is None:
+                return {"exchanges": 0, "total_tokens_estimate": 0}
+            
+            total_chars = sum(map(len, memory.users)) + sum(map(len, memory.assistants))
+            
+            return {
+                "exchanges": len(memory),
+                "total_chars": total_chars,
+                "estimated_tokens": total_chars // 4  # Rough estimate
+            }
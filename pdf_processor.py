@@ -1,50 +1,96 @@
-import PyPDF2
-import chromadb
+import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+MAX_SEARCH_RESULTS = int(os.getenv("MAX_SEARCH_RESULTS", "3"))
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+ADD_BATCH_SIZE = 128
+# Batches embedded and inserted concurrently; ONNX Runtime already threads each batch, so keep this small
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+
+# HNSW index settings for newly created collections (existing collections keep theirs).
+# Chroma 1.5 defaults to ef_construction/ef_search 100 and M 16; these raise each for better recall.
+HNSW_METADATA = {
+    "hnsw:construction_ef": 200,
+    "hnsw:M": 32,
+    "hnsw:search_ef": 128
+}
+
+# Process-wide collection handle, opened on first use
+_collection = None
+_collection_lock = threading.Lock()
+
 def extract_pdf_text(pdf_path):
+    import PyPDF2  # Deferred so querying never pays for the PDF reader
     with open(pdf_path, 'rb') as file:
         reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()
-    return text
+        return "".join(page.extract_text() or "" for page in reader.pages)
+
+def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Yield fixed-size chunks, each sharing `overlap` characters with the previous one"""
+    if not text:
+        return
+    step = max(size - overlap, 1)
+    for i in range(0, max(len(text) - overlap, 1), step):
+        yield text[i:i+size]
 
 def setup_chromadb():
-    # Ensure directory exists
-    db_path = os.getenv("CHROMA_DB_PATH", "./chroma_db")
-    os.makedirs(db_path, exist_ok=True)
-    
-    client = chromadb.PersistentClient(path=db_path)
-    collection = client.get_or_create_collection(os.getenv("CHROMA_COLLECTION_NAME", "documents"))
-    return collection
+    """Return the shared collection, opening the client and collection only once"""
+    global _collection
+    with _collection_lock:
+        if _collection is None:
+            # Ensure directory exists
+            db_path = os.getenv("CHROMA_DB_PATH", "./chroma_db")
+            os.makedirs(db_path, exist_ok=True)
+            
+            import chromadb  # Deferred until the first document search or ingestion
+            client = chromadb.PersistentClient(path=db_path)
+            _collection = client.get_or_create_collection(
+                os.getenv("CHROMA_COLLECTION_NAME", "documents"), metadata=HNSW_METADATA
+            )
+        return _collection
 
 def load_pdf_to_chroma(pdf_path):
     """Load PDF content into ChromaDB - only call when adding new documents"""
     text = extract_pdf_text(pdf_path)
     collection = setup_chromadb()
     
-    # Split text into chunks
-    chunks = [text[i:i+1000] for i in range(0, len(text), 1000)]
+    # Split text into overlapping chunks
+    chunks = list(chunk_text(text))
     
-    collection.add(
-        documents=chunks,
-        ids=[f"chunk_{i}" for i in range(len(chunks))],
-        metadatas=[{"source": pdf_path} for _ in chunks]
-    )
+    def add_batch(start):
+        batch = chunks[start:start+ADD_BATCH_SIZE]
+        collection.add(
+            documents=batch,
+            ids=[f"chunk_{i}" for i in range(start, start + len(batch))],
+            metadatas=[{"source": pdf_path} for _ in batch]
+        )
+    
+    # Embed and insert batches in parallel; list() re-raises the first failed batch
+    with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as executor:
+        list(executor.map(add_batch, range(0, len(chunks), ADD_BATCH_SIZE)))
     return chunks
 
 def query_chroma(query, n_results=None):
     """Query ChromaDB for relevant documents"""
+    return query_chroma_batch([query], n_results)[0]
+
+def query_chroma_batch(queries, n_results=None):
+    """Query ChromaDB for several queries in one call, returning a document list per query"""
+    queries = list(queries)
     if n_results is None:
-        n_results = int(os.getenv("MAX_SEARCH_RESULTS", "3"))
+        n_results = MAX_SEARCH_RESULTS
     try:
         collection = setup_chromadb()
-        results = collection.query(query_texts=[query], n_results=n_results)
-        return results['documents'][0] if results['documents'] else []
+        results = collection.query(query_texts=queries, n_results=n_results)
+        return results['documents'] or [[] for _ in queries]
     except Exception as e:
-        print(f"ChromaDB query error: {e}")
-        return []
+        logger.warning("ChromaDB query error: %s", e)
+        return [[] for _ in queries]
@@ -0,0 +1,109 @@
+"""
+Response Cache Module for OpenAI Agent App
+Handles exact-match and semantic caching of chat completion responses
+"""
+
+import bisect
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+import numpy as np
+import orjson
+from cachetools import TTLCache
+from openai import OpenAI
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    def __init__(self):
+        self.cache: TTLCache = TTLCache(
+            maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "2048")),
+            ttl=int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+        )
+        # TTLCache evicts inside get/set, and callers span the app loop, the background loop and worker threads
+        self._lock = threading.Lock()
+    
+    def make_key(self, model: str, messages: List[Dict], **params) -> str:
+        """Build a cache key from the canonical JSON of the completion request"""
+        payload = {"model": model, "messages": messages, **params}
+        return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        """Get a cached response, or None on miss"""
+        with self._lock:
+            return self.cache.get(key)
+    
+    def set(self, key: str, response: str):
+        """Store a completed response"""
+        with self._lock:
+            self.cache[key] = response
+
+
+class SemanticCache:
+    def __init__(self, openai_client: OpenAI):
+        self.client = openai_client
+        self.embedding_model = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+        self.threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+        self.max_entries = int(os.getenv("SEMANTIC_CACHE_SIZE", "2048"))
+        self.ttl = int(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+        self.embeddings: Optional[np.ndarray] = None  # (N, dim), rows normalized
+        self.responses: List[str] = []
+        self.created: List[float] = []  # Insertion times, oldest first
+        # Lookups and adds run on both the app's event loop and the background loop thread
+        self._lock = threading.Lock()
+    
+    def embed(self, query: str) -> Optional[np.ndarray]:
+        """Embed a query as a normalized vector, or None if embedding fails"""
+        try:
+            response = self.client.embeddings.create(model=self.embedding_model, input=query)
+            vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+            return vector / np.linalg.norm(vector)
+        except Exception as e:
+            logger.warning("Embedding API error: %s", e)
+            return None
+    
+    def _expire(self):
+        """Drop entries older than the TTL; must be called with the lock held"""
+        stale = bisect.bisect_left(self.created, time.time() - self.ttl)
+        if stale:
+            self.embeddings = self.embeddings[stale:] if stale < len(self.created) else None
+            del self.responses[:stale]
+            del self.created[:stale]
+    
+    def lookup(self, vector: Optional[np.ndarray]) -> Optional[str]:
+        """Return the cached response most similar to the query vector, if above threshold"""
+        if vector is None:
+            return None
+        
+        with self._lock:
+            self._expire()
+            if self.embeddings is None:
+                return None
+            similarities = self.embeddings @ vector
+            best = int(similarities.argmax())
+            if similarities[best] >= self.threshold:
+                return self.responses[best]
+            return None
+    
+    def add(self, vector: Optional[np.ndarray], response: str):
+        """Store a response under its query vector, evicting the oldest entry when full"""
+        if vector is None:
+            return
+        
+        with self._lock:
+            self._expire()
+            if self.embeddings is None:
+                self.embeddings = vector[np.newaxis, :]
+            else:
+                self.embeddings = np.vstack([self.embeddings, vector])
+            self.responses.append(response)
+            self.created.append(time.time())
+            
+            if len(self.responses) > self.max_entries:
+                self.embeddings = self.embeddings[-self.max_entries:]
+                self.responses = self.responses[-self.max_entries:]
+                self.created = self.created[-self.max_entries:]
@@ -4,23 +4,37 @@ Test script for refactored OpenAI Agent App
 Tests memory management and guardrails functionality
 """
 
+import asyncio
 import os
 import sys
+import pytest
 from dotenv import load_dotenv
+from memory_manager import NO_CONVERSATION
+
+REQUIRED_VARS = ["OPENAI_API_KEY", "TAVILY_API_KEY"]
 
 # Load environment variables
 load_dotenv()
 
-def test_agent_initialization():
-    """Test that the agent initializes correctly with new modules"""
+# Test blocked content (Taiwan politics)
+GUARDRAIL_QUERIES = (
+    ("Tell me about Taiwan politics", True),  # Should be blocked
+    ("What's the weather like today?", False),  # Should pass
+    ("Taiwan independence movement", True),  # Should be blocked
+    ("How does machine learning work?", False)  # Should pass
+)
+WEB_QUERIES = ("What's the weather today?", "Latest news about AI", "Current stock price")
+DOC_QUERIES = ("What did Amazon say about AI?", "Amazon revenue 2023", "AWS financial results")
+ROUTING_QUERIES = list(WEB_QUERIES + DOC_QUERIES)
+
+def create_agent():
+    """Create the agent for the script run, reporting whether its modules initialized"""
     try:
         from agent import OpenAIAgentSDK
         agent = OpenAIAgentSDK()
         print("✅ Agent initialization successful")
         
-        # Test that modules are properly initialized
-        assert hasattr(agent, 'memory_manager'), "Memory manager not initialized"
-        assert hasattr(agent, 'guardrails_manager'), "Guardrails manager not initialized"
+        check_managers_initialized(agent)
         print("✅ Memory and guardrails managers initialized")
         
         return agent
@@ -28,98 +42,136 @@ def test_agent_initialization():
         print(f"❌ Agent initialization failed: {e}")
         return None
 
-def test_guardrails(agent):
+def check_managers_initialized(agent):
+    """Assert that the memory and guardrails managers were created"""
+    # One subset check against the instance dict instead of probing each attribute
+    missing = {'memory_manager', 'guardrails_manager'} - agent.__dict__.keys()
+    assert not missing, f"Managers not initialized: {missing}"
+
+def test_agent_initialization(agent):
+    """Test that the agent initializes correctly with new modules"""
+    check_managers_initialized(agent)
+
+@pytest.mark.anyio
+async def test_guardrails(agent):
     """Test guardrails functionality"""
-    print("\n🔒 Testing Guardrails...")
-    
-    # Test blocked content (Taiwan politics)
-    test_queries = [
-        ("Tell me about Taiwan politics", True),  # Should be blocked
-        ("What's the weather like today?", False),  # Should pass
-        ("Taiwan independence movement", True),  # Should be blocked
-        ("How does machine learning work?", False)  # Should pass
-    ]
+    # Check all queries with a single moderation call
+    results = await asyncio.to_thread(agent.check_guardrails_batch, [query for query, _ in GUARDRAIL_QUERIES])
     
-    for query, should_be_blocked in test_queries:
-        is_blocked, response = agent.check_guardrails(query)
-        
-        if is_blocked == should_be_blocked:
-            status = "✅"
-        else:
-            status = "❌"
-        
-        print(f"{status} Query: '{query}' - Blocked: {is_blocked}")
+    # Collect the report and write it once so it isn't interleaved with the other test phases
+    out = ["\n🔒 Testing Guardrails..."]
+    # Only mismatched verdicts are reported in detail
+    mismatches = [
+        (query, is_blocked, response)
+        for (query, should_be_blocked), (is_blocked, response) in zip(GUARDRAIL_QUERIES, results)
+        if is_blocked != should_be_blocked
+    ]
+    if not mismatches:
+        out.append(f"✅ All {len(GUARDRAIL_QUERIES)} guardrail checks passed")
+    for query, is_blocked, response in mismatches:
+        out.append(f"❌ Query: '{query}' - Blocked: {is_blocked}")
         if is_blocked:
-            print(f"   Response: {response[:100]}...")
+            out.append(f"   Response: {response[:100]}...")
+    sys.stdout.write("\n".join(out) + "\n")
+    assert not mismatches, f"Wrong guardrail verdicts: {[query for query, _, _ in mismatches]}"
 
-def test_memory_management(agent):
+@pytest.mark.anyio
+async def test_memory_management(agent):
     """Test memory management functionality"""
-    print("\n🧠 Testing Memory Management...")
+    passed = 0
+    errors = []
+    
+    def check(condition, description):
+        nonlocal passed
+        if condition:
+            passed += 1
+        else:
+            errors.append(description)
     
     session_id = "test_session"
     
     # Test initial memory state
     context = agent.memory_manager.get_memory_context(session_id)
-    assert context == "No previous conversation.", f"Expected empty memory, got: {context}"
-    print("✅ Initial memory state correct")
+    check(context == NO_CONVERSATION, "Initial memory state not empty")
     
     # Test memory updates
     agent.memory_manager.update_memory(session_id, "Hello", "Hi there!")
     agent.memory_manager.update_memory(session_id, "How are you?", "I'm doing well, thanks!")
     
     context = agent.memory_manager.get_memory_context(session_id)
-    assert "Hello" in context and "Hi there!" in context, "Memory not storing correctly"
-    print("✅ Memory storage working")
+    check("Hello" in context and "Hi there!" in context, "Memory not storing correctly")
     
     # Test memory stats
     stats = agent.memory_manager.get_session_stats(session_id)
-    assert stats["exchanges"] == 2, f"Expected 2 exchanges, got {stats['exchanges']}"
-    print("✅ Memory statistics working")
+    check(stats["exchanges"] == 2, "Memory statistics not counting exchanges")
     
     # Test memory clearing
     agent.memory_manager.clear_session_memory(session_id)
     context = agent.memory_manager.get_memory_context(session_id)
-    assert context == "No previous conversation.", "Memory not cleared properly"
-    print("✅ Memory clearing working")
+    check(context == NO_CONVERSATION, "Memory not cleared properly")
+    
+    # Report once after every check has run
+    out = ["\n🧠 Testing Memory Management..."]
+    out.extend(f"❌ {error}" for error in errors)
+    out.append(f"{'✅' if not errors else '❌'} Memory checks: {passed} passed, {len(errors)} failed")
+    sys.stdout.write("\n".join(out) + "\n")
+    assert not errors, "; ".join(errors)
 
-def test_tool_routing(agent):
+@pytest.mark.anyio
+async def test_tool_routing(agent):
     """Test intelligent tool routing"""
-    print("\n🔧 Testing Tool Routing...")
+    out = ["\n🔧 Testing Tool Routing..."]
+    
+    # Route every query in one pass
+    routes = agent.route_batch(ROUTING_QUERIES)
     
     # Test web search detection
-    web_queries = ["What's the weather today?", "Latest news about AI", "Current stock price"]
-    for query in web_queries:
-        needs_web = agent.needs_web_search(query)
-        print(f"{'✅' if needs_web else '❌'} Web search for: '{query}' - Detected: {needs_web}")
+    out.extend(
+        f"{'✅' if needs_web else '❌'} Web search for: '{query}' - Detected: {needs_web}"
+        for query, (needs_web, _) in zip(WEB_QUERIES, routes)
+    )
     
     # Test document search detection
-    doc_queries = ["What did Amazon say about AI?", "Amazon revenue 2023", "AWS financial results"]
-    for query in doc_queries:
-        needs_doc = agent.needs_document_search(query)
-        print(f"{'✅' if needs_doc else '❌'} Doc search for: '{query}' - Detected: {needs_doc}")
+    out.extend(
+        f"{'✅' if needs_doc else '❌'} Doc search for: '{query}' - Detected: {needs_doc}"
+        for query, (_, needs_doc) in zip(DOC_QUERIES, routes[len(WEB_QUERIES):])
+    )
+    sys.stdout.write("\n".join(out) + "\n")
+    
+    missed = [query for query, (needs_web, _) in zip(WEB_QUERIES, routes) if not needs_web]
+    missed += [query for query, (_, needs_doc) in zip(DOC_QUERIES, routes[len(WEB_QUERIES):]) if not needs_doc]
+    assert not missed, f"Routing not detected for: {missed}"
+
+async def run_tests(agent):
+    """Run the guardrails, memory and routing tests concurrently"""
+    await asyncio.gather(
+        test_guardrails(agent),
+        test_memory_management(agent),
+        test_tool_routing(agent)
+    )
 
 def main():
     """Run all tests"""
     print("🧪 Testing Refactored OpenAI Agent App\n")
     
     # Check environment variables
-    required_vars = ["OPENAI_API_KEY", "TAVILY_API_KEY"]
-    missing_vars = [var for var in required_vars if not os.getenv(var)]
+    missing_vars = [var for var in REQUIRED_VARS if not os.getenv(var)]
     
     if missing_vars:
         print(f"❌ Missing environment variables: {missing_vars}")
         print("Please check your .env file")
         return
     
+    # Keep test conversations out of the app's persisted memory
+    os.environ["MEMORY_DB_PATH"] = ""
+    
     # Test agent initialization
-    agent = test_agent_initialization()
+    agent = create_agent()
     if not agent:
         return
     
-    # Run tests
-    test_guardrails(agent)
-    test_memory_management(agent)
-    test_tool_routing(agent)
+    # Run the independent test phases concurrently
+    asyncio.run(run_tests(agent))
     
     print("\n🎉 All tests completed!")
     print("\nRefactored modules:")